@@ -0,0 +1,86 @@
+import http.client
+import json
+import os
+import socketserver
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.token = None
+
+    def request(self, method, path, body=None, headers=None, **kwargs):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        conn.request(method, path, body, headers, **kwargs)
+        response = conn.getresponse()
+        status, data = response.status, json.loads(response.read() or b'{}')
+        conn.close()
+        return status, data
+
+    def post(self, path, body=None, **kwargs):
+        return self.request('POST', path, body, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+
+@pytest.fixture
+def bank(tmp_path, monkeypatch):
+    """A two-shard server on a scratch database, serving requests without its background threads."""
+    server.shard_writers.clear()
+    for state in (server.sessions, server._shard_cache, server._email_cache, server.velocity['account'], server.velocity['user'],
+                  server.card_cache, server.account_cache, server.account_generations, server.holds, server.account_held,
+                  server.card_held, server.account_reserved, server.hold_expiry):
+        state.clear()
+    monkeypatch.setattr(server, 'CARD_NETWORK_KEY', 'network-key')
+    app = server.create_app({'db_file': str(tmp_path / 'banking.db'), 'shards': 2, 'host': '127.0.0.1', 'port': 0,
+                             'workers': 4, 'admin_token': 'admin-token'})
+    thread = threading.Thread(target=socketserver.BaseServer.serve_forever, args=(app, 0.05), daemon=True)
+    thread.start()
+    yield app
+    app.shutdown()
+    app.server_close()
+
+
+@pytest.fixture
+def client(bank):
+    return lambda: Client(bank.server_address[1])
+
+
+@pytest.fixture
+def customer(client):
+    """Registers a customer and returns (client, user_id, shard, {account type: account id})."""
+    count = 0
+
+    def register(shard=None, deposit=0):
+        nonlocal count
+        while True:
+            count += 1
+            user = client()
+            email = f'customer{count}@example.com'
+            status, data = user.post('/api/register', {'name': 'Test Customer', 'email': email, 'password': 'secret1'})
+            assert data['success'], data
+            user_id, user_shard = server.lookup_email(email)
+            if shard is None or user_shard == shard:
+                break
+        user.token = data['token']
+        accounts = {account['type']: account['id'] for account in user.get('/api/accounts')[1]['accounts']}
+        if deposit:
+            assert user.post('/api/deposit', {'account_id': 'checking', 'amount': deposit})[1]['success']
+        return user, user_id, user_shard, accounts
+
+    return register
+
@@ -0,0 +1,265 @@
+import json
+import time
+
+import server
+
+
+def balance(account_id):
+    for shard in range(server.SHARD_COUNT):
+        conn = server.connect_db(shard)
+        row = conn.execute('SELECT balance FROM accounts WHERE id = ?', (account_id,)).fetchone()
+        conn.close()
+        if row:
+            return row[0]
+
+
+def outbox(shard):
+    conn = server.connect_db(shard)
+    rows = conn.execute('SELECT id, account_id, amount, status, attempts FROM credit_outbox ORDER BY id').fetchall()
+    conn.close()
+    return rows
+
+
+def test_atomic_batch_rejects_every_item_when_one_fails(customer):
+    payer, _, shard, accounts = customer(deposit=1000)
+    _, _, _, payee = customer(shard=shard)
+    status, data = payer.post('/api/transfers/batch', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 100},
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': -5},
+    ]})
+    assert status == 200
+    assert not data['success'] and data['posted'] == 0
+    assert data['results'] == [{'index': 1, 'success': False, 'message': 'Invalid amount'}]
+    assert balance(accounts['checking']) == 1000
+    assert balance(payee['checking']) == 0
+
+
+def test_per_item_batch_posts_the_items_that_pass(customer):
+    payer, _, shard, accounts = customer(deposit=1000)
+    _, _, _, payee = customer(shard=shard)
+    status, data = payer.post('/api/transfers/batch?atomic=false', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 300},
+        {'from_account_id': accounts['checking'], 'to_account_id': 'no-such-account', 'amount': 10},
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['savings'], 'amount': 900},
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['savings'], 'amount': 200},
+    ]})
+    assert data['success'] and not data['atomic']
+    assert (data['posted'], data['failed'], data['total']) == (2, 2, 500)
+    assert [(r['index'], r['success'], r.get('message')) for r in data['results']] == [
+        (0, True, None), (1, False, 'Recipient account not found'), (2, False, 'Insufficient balance'), (3, True, None)]
+    assert data['balances'] == {accounts['checking']: 500}
+    assert (balance(payee['checking']), balance(payee['savings'])) == (300, 200)
+
+
+def test_cross_shard_credits_are_delivered_through_the_outbox(customer):
+    payer, _, shard, accounts = customer(deposit=1000)
+    _, _, other, payee = customer(shard=1 - shard)
+    status, data = payer.post('/api/transfers/batch', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 250, 'description': 'Payroll'},
+    ]})
+    assert data['success'] and data['message'] == 'Batch posted successfully'
+    assert balance(accounts['checking']) == 750
+    assert balance(payee['checking']) == 250
+    [(credit_id, account_id, amount, status, _)] = outbox(shard)
+    assert (account_id, amount, status) == (payee['checking'], 250, 'applied')
+    conn = server.connect_db(other)
+    assert conn.execute('SELECT amount, balance_after FROM transactions WHERE id = ?', (credit_id,)).fetchone() == (250, 250)
+    conn.close()
+
+
+def test_failed_credits_stay_pending_and_are_delivered_once(customer, monkeypatch):
+    payer, _, shard, accounts = customer(deposit=1000)
+    _, _, other, payee = customer(shard=1 - shard)
+    post_remote_credits = server.post_remote_credits
+
+    def unavailable(shard, credits):
+        raise RuntimeError('shard unavailable')
+    monkeypatch.setattr(server, 'post_remote_credits', unavailable)
+    status, data = payer.post('/api/transfers/batch', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 100},
+    ]})
+    assert data['success'] and data['message'].endswith('some recipient credits are still pending')
+    assert balance(accounts['checking']) == 900
+    assert balance(payee['checking']) == 0
+    [(credit_id, _, _, status, attempts)] = outbox(shard)
+    assert (status, attempts) == ('pending', 1)
+
+    # A delivery that posted but never marked the outbox is skipped when it is retried
+    monkeypatch.setattr(server, 'post_remote_credits', post_remote_credits)
+    pending = [(credit_id, payee['checking'], '', 100, 'Batch transfer', '2026-01-01T00:00:00')]
+    assert server.post_remote_credits(other, pending)[0] == {credit_id}
+    assert server.deliver_credits(shard) == {credit_id}
+    assert server.deliver_credits(shard) == set()
+    assert balance(payee['checking']) == 100
+    assert outbox(shard)[0][3] == 'applied'
+
+
+def test_payroll_above_single_transfer_limits_posts(customer):
+    payer, _, shard, accounts = customer(deposit=100000)
+    _, _, _, payee = customer(shard=shard)
+    payer.post('/api/deposit', {'account_id': 'checking', 'amount': 100000})
+    items = [{'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 40000}] * 5
+    status, data = payer.post('/api/transfers/batch', {'items': items})
+    assert data['message'] == 'Batch posted successfully' and data['held'] == 0
+    assert balance(payee['checking']) == 200000
+
+
+def test_held_batch_is_not_debited_until_approved(customer, client, monkeypatch):
+    monkeypatch.setattr(server, 'BATCH_FRAUD_RULES', [{'name': 'batch_total', 'scope': 'posting', 'limit': 500, 'action': 'hold'}])
+    payer, _, shard, accounts = customer(deposit=1000)
+    _, _, _, payee = customer(shard=1 - shard)
+    status, data = payer.post('/api/transfers/batch', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 400},
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['savings'], 'amount': 200},
+    ]})
+    assert data['success'] and data['message'] == 'Batch held for review'
+    assert (data['posted'], data['held']) == (0, 2)
+    assert balance(accounts['checking']) == 1000
+
+    admin = client()
+    assert admin.get('/api/admin/transfers/held')[0] == 403
+    headers = {'X-Admin-Token': 'admin-token'}
+    [batch] = admin.get('/api/admin/transfers/held', headers=headers)[1]['batches']
+    assert batch['batch_id'] == data['batch_id'] and batch['sources'][0]['total'] == 600
+
+    status, review = admin.post('/api/admin/transfers/review', {'batch_id': data['batch_id'], 'action': 'approve'}, headers=headers)
+    assert review['success'] and review['message'] == '2 transfers posted'
+    assert balance(accounts['checking']) == 400
+    assert (balance(payee['checking']), balance(payee['savings'])) == (400, 200)
+    status, again = admin.post('/api/admin/transfers/review', {'batch_id': data['batch_id'], 'action': 'reject'}, headers=headers)
+    assert status == 404
+    assert admin.get('/api/admin/transfers/held', headers=headers)[1]['batches'] == []
+
+
+def test_rejected_and_partly_held_batches(customer, client, monkeypatch):
+    monkeypatch.setattr(server, 'BATCH_FRAUD_RULES', [{'name': 'batch_total', 'scope': 'posting', 'limit': 500, 'action': 'hold'}])
+    payer, _, shard, accounts = customer(deposit=1000)
+    payer.post('/api/deposit', {'account_id': 'savings', 'amount': 1000})
+    _, _, _, payee = customer(shard=shard)
+    status, data = payer.post('/api/transfers/batch?atomic=false', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 600},
+        {'from_account_id': accounts['savings'], 'to_account_id': payee['checking'], 'amount': 100},
+    ]})
+    assert data['message'] == '1 of 2 transfers posted; 1 held for review'
+    assert [r.get('held', False) for r in data['results']] == [True, False]
+    assert (balance(accounts['checking']), balance(accounts['savings']), balance(payee['checking'])) == (1000, 900, 100)
+
+    headers = {'X-Admin-Token': 'admin-token'}
+    status, review = client().post('/api/admin/transfers/review', {'batch_id': data['batch_id'], 'action': 'reject'}, headers=headers)
+    assert review['message'] == '1 transfers rejected'
+    assert (balance(accounts['checking']), balance(payee['checking'])) == (1000, 100)
+
+
+def test_held_transfer_and_bill_payment_wait_for_review(customer, client, monkeypatch):
+    monkeypatch.setattr(server, 'FRAUD_RULES', [{'name': 'large_amount', 'scope': 'posting', 'limit': 500, 'action': 'hold'}])
+    payer, _, _, accounts = customer(deposit=1000)
+    status, data = payer.post('/api/transfer', {'from_account_id': accounts['checking'], 'amount': 600, 'description': 'Rent'})
+    assert data['success'] and data['decision'] == 'hold'
+    assert balance(accounts['checking']) == 1000
+
+    bill = payer.get('/api/bills')[1]['bills'][0]
+    status, paid = payer.post('/api/pay-bill', {'bill_id': bill['id'], 'account_id': accounts['checking'], 'amount': 700})
+    assert paid['decision'] == 'hold' and balance(accounts['checking']) == 1000
+    assert payer.get('/api/bills')[1]['bills'][0]['status'] == 'processing'
+
+    admin = client()
+    headers = {'X-Admin-Token': 'admin-token'}
+    assert {batch['batch_id'] for batch in admin.get('/api/admin/transfers/held', headers=headers)[1]['batches']} == {
+        data['batch_id'], paid['batch_id']}
+    status, review = admin.post('/api/admin/transfers/review', {'batch_id': data['batch_id'], 'action': 'approve'}, headers=headers)
+    assert review['success'] and balance(accounts['checking']) == 400
+    status, review = admin.post('/api/admin/transfers/review', {'batch_id': paid['batch_id'], 'action': 'approve'}, headers=headers)
+    assert status == 409 and review['message'] == 'Insufficient balance'
+    status, review = admin.post('/api/admin/transfers/review', {'batch_id': paid['batch_id'], 'action': 'reject'}, headers=headers)
+    assert review['success'] and balance(accounts['checking']) == 400
+    assert payer.get('/api/bills')[1]['bills'][0]['status'] == 'pending'
+
+
+def test_card_holds_reduce_funds_for_batches_and_approvals(customer, client, monkeypatch):
+    monkeypatch.setattr(server, 'BATCH_FRAUD_RULES', [{'name': 'batch_total', 'scope': 'posting', 'limit': 500, 'action': 'hold'}])
+    payer, user_id, shard, accounts = customer(deposit=1000)
+    _, _, _, payee = customer(shard=shard)
+    [card] = [card for card in server.get_user_cards(user_id) if card['account_id'] == accounts['checking']]
+    network = client()
+    status, data = payer.post('/api/transfers/batch', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 700}]})
+    assert data['held'] == 1
+    authorization = network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': 800, 'merchant': 'Shop'},
+                                 headers={'X-Network-Key': 'network-key'})[1]
+    assert authorization['decision'] == 'approve'
+
+    status, data2 = payer.post('/api/transfers/batch', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 300}]})
+    assert not data2['success'] and data2['results'][0]['message'] == 'Insufficient balance'
+    status, review = client().post('/api/admin/transfers/review', {'batch_id': data['batch_id'], 'action': 'approve'},
+                                   headers={'X-Admin-Token': 'admin-token'})
+    assert status == 409 and review['message'] == 'Insufficient balance'
+    assert balance(accounts['checking']) == 1000
+
+
+def ndjson(*items):
+    return ''.join(item if isinstance(item, str) else json.dumps(item) + '\n' for item in items).encode()
+
+
+def test_ndjson_lines_are_parsed_one_by_one(customer):
+    payer, _, shard, accounts = customer(deposit=1000)
+    _, _, _, payee = customer(shard=shard)
+    leg = {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 10}
+    body = ndjson(leg, '\n', 'not json\n', {**leg, 'amount': 'ten'}, leg)
+    status, data = payer.post('/api/transfers/batch?atomic=false', body, headers={'Content-Type': 'application/x-ndjson'})
+    assert (data['posted'], data['failed']) == (2, 2)
+    assert [r['success'] for r in data['results']] == [True, False, False, True]
+    assert data['results'][2]['message'] == 'Invalid amount'
+
+    status, data = payer.post('/api/transfers/batch', body, headers={'Content-Type': 'application/x-ndjson'})
+    assert data['atomic'] and data['posted'] == 0
+    assert balance(payee['checking']) == 20
+
+
+def test_chunked_ndjson_upload_splits_lines_across_chunks(customer):
+    payer, _, shard, accounts = customer(deposit=1000)
+    _, _, _, payee = customer(shard=shard)
+    body = ndjson(*[{'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 1, 'description': f'Item {n}'}
+                    for n in range(25)]).rstrip(b'\n')
+    chunks = [body[i:i + 37] for i in range(0, len(body), 37)]
+    status, data = payer.post('/api/transfers/batch', iter(chunks), encode_chunked=True,
+                              headers={'Content-Type': 'application/x-ndjson', 'Transfer-Encoding': 'chunked',
+                                       'Expect': '100-continue'})
+    assert data['message'] == 'Batch posted successfully' and data['posted'] == 25
+    assert balance(payee['checking']) == 25
+
+
+def test_batch_limits_and_empty_bodies(customer, monkeypatch):
+    payer, _, shard, accounts = customer(deposit=1000)
+    assert payer.post('/api/transfers/batch', b'')[1] == {'success': False, 'message': 'No transfers in batch'}
+    assert payer.post('/api/transfers/batch', {'items': []})[1]['message'] == 'No transfers in batch'
+    monkeypatch.setattr(server, 'BATCH_MAX_ITEMS', 2)
+    leg = {'from_account_id': accounts['checking'], 'to_account_id': accounts['savings'], 'amount': 1}
+    status, data = payer.post('/api/transfers/batch', [leg] * 3)
+    assert status == 413 and not data['success']
+    assert balance(accounts['checking']) == 1000
+
+
+def test_atomic_flag_spelled_as_text_in_the_body(customer):
+    payer, _, shard, accounts = customer(deposit=1000)
+    _, _, _, payee = customer(shard=shard)
+    status, data = payer.post('/api/transfers/batch', {'atomic': 'false', 'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 100},
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': -5},
+    ]})
+    assert data['atomic'] is False and data['posted'] == 1
+    assert balance(accounts['checking']) == 900
+
+
+def test_warm_up_counts_a_batch_once_per_source(customer):
+    payer, user_id, shard, accounts = customer(deposit=1000)
+    _, _, _, payee = customer(shard=shard)
+    payer.post('/api/transfers/batch', {'items': [
+        {'from_account_id': accounts['checking'], 'to_account_id': payee['checking'], 'amount': 10} for _ in range(20)]})
+    payer.post('/api/transfer', {'from_account_id': accounts['checking'], 'amount': 50})
+    recorded = server.velocity_windows('account', accounts['checking'])['1m'].totals(time.time())
+
+    server.velocity['account'].clear()
+    server.velocity['user'].clear()
+    assert server.warm_screening() == 2
+    assert server.velocity_windows('account', accounts['checking'])['1m'].totals(time.time()) == recorded == (2, 250)
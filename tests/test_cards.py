@@ -0,0 +1,80 @@
+import server
+from test_batch_transfers import balance
+
+NETWORK = {'X-Network-Key': 'network-key'}
+
+
+def debit_card(user_id, accounts):
+    [card] = [card for card in server.get_user_cards(user_id) if card['account_id'] == accounts['checking']]
+    return card
+
+
+def hold_status(hold_id, shard):
+    conn = server.connect_db(shard)
+    row = conn.execute('SELECT status FROM card_holds WHERE id = ?', (hold_id,)).fetchone()
+    conn.close()
+    return row and row[0]
+
+
+def test_authorization_holds_funds_until_captured(customer, client):
+    payer, user_id, shard, accounts = customer(deposit=1000)
+    card = debit_card(user_id, accounts)
+    network = client()
+    status, auth = network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': 300, 'merchant': 'Shop'}, headers=NETWORK)
+    assert auth['decision'] == 'approve' and auth['available'] == 700
+    assert balance(accounts['checking']) == 1000
+
+    status, data = payer.post('/api/transfer', {'from_account_id': accounts['checking'], 'amount': 800})
+    assert not data['success'] and data['message'] == 'Insufficient balance'
+
+    status, capture = network.post('/api/cards/capture', {'hold_id': auth['hold_id'], 'amount': 250}, headers=NETWORK)
+    assert capture['success'] and capture['balance'] == 750
+    assert balance(accounts['checking']) == 750
+    assert hold_status(auth['hold_id'], shard) == 'captured'
+    assert server.account_held[accounts['checking']] == 0
+    status, again = network.post('/api/cards/capture', {'hold_id': auth['hold_id']}, headers=NETWORK)
+    assert not again['success'] and balance(accounts['checking']) == 750
+
+
+def test_authorization_declines(customer, client):
+    payer, user_id, _, accounts = customer(deposit=1000)
+    card = debit_card(user_id, accounts)
+    network = client()
+    authorize = lambda amount: network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': amount}, headers=NETWORK)[1]
+
+    assert client().post('/api/cards/authorize', {'card_id': card['id'], 'amount': 10})[0] == 403
+    assert network.post('/api/cards/authorize', {'card_id': 'nope', 'amount': 10}, headers=NETWORK)[1]['reasons'] == ['unknown_card']
+    assert authorize(float('nan'))['message'] == 'Invalid amount'
+    assert authorize(1200)['reasons'] == ['insufficient_funds']
+    assert authorize(900)['decision'] == 'approve'
+    assert authorize(200)['reasons'] == ['insufficient_funds']
+
+    payer.post('/api/cards/update', {'id': card['id'], 'status': 'frozen'})
+    assert authorize(10)['reasons'] == ['card_frozen']
+
+
+def test_card_limit_counts_pending_holds(customer, client):
+    payer, user_id, _, accounts = customer(deposit=10000)
+    card = debit_card(user_id, accounts)
+    network = client()
+    first = network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': 4000}, headers=NETWORK)[1]
+    assert network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': 2000}, headers=NETWORK)[1]['reasons'] == ['over_card_limit']
+    network.post('/api/cards/capture', {'hold_id': first['hold_id']}, headers=NETWORK)
+    assert network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': 2000}, headers=NETWORK)[1]['decision'] == 'approve'
+
+
+def test_capture_bounds_and_expired_holds(customer, client, monkeypatch):
+    payer, user_id, _, accounts = customer(deposit=1000)
+    card = debit_card(user_id, accounts)
+    network = client()
+    auth = network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': 300}, headers=NETWORK)[1]
+    for amount in (301, 0, float('nan')):
+        status, data = network.post('/api/cards/capture', {'hold_id': auth['hold_id'], 'amount': amount}, headers=NETWORK)
+        assert not data['success']
+    assert balance(accounts['checking']) == 1000
+
+    monkeypatch.setattr(server, 'HOLD_TTL', 0)
+    expired = network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': 500}, headers=NETWORK)[1]
+    status, data = network.post('/api/cards/capture', {'hold_id': expired['hold_id']}, headers=NETWORK)
+    assert data['message'] == 'Hold not found or expired'
+    assert network.post('/api/cards/authorize', {'card_id': card['id'], 'amount': 700}, headers=NETWORK)[1]['decision'] == 'approve'
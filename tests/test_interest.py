@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+import server
+from test_batch_transfers import balance
+
+DAILY_RATE = 1.025 ** (1 / 365) - 1
+
+
+def accrual(account_id, shard):
+    conn = server.connect_db(shard)
+    row = conn.execute('SELECT accrued_interest, accrued_through FROM accounts WHERE id = ?', (account_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def interest_postings(account_id, shard):
+    conn = server.connect_db(shard)
+    rows = conn.execute("SELECT amount, balance_after, created_at FROM transactions WHERE from_account_id = ? AND description = 'Interest credit'",
+                        (account_id,)).fetchall()
+    conn.close()
+    return rows
+
+
+def test_accruals_and_credit_split():
+    accrued = server.compute_accruals([36500.0, -500.0, 1000.0], [2.5, 2.5, 0.0], [0.25, 0.1, 0.0], [2, 3, 1])
+    assert [float(a) for a in accrued] == pytest.approx([0.25 + 36500 * DAILY_RATE * 2, 0.1, 0.0])
+    credits, remainder = server.split_credits([4.567, 0.009, 12.0])
+    assert credits == [4.56, 0.0, 12.0]
+    assert remainder == pytest.approx([0.007, 0.009, 0.0])
+
+
+def test_month_end_credits_whole_paisa_and_carries_the_rest(customer):
+    payer, _, shard, accounts = customer()
+    payer.post('/api/deposit', {'account_id': 'savings', 'amount': 100000})
+    savings = accounts['savings']
+
+    assert server.accrue_interest(shard, '2026-01-30') == 1
+    assert balance(savings) == 100000 and interest_postings(savings, shard) == []
+    assert accrual(savings, shard) == (pytest.approx(100000 * DAILY_RATE), '2026-01-30')
+
+    assert server.accrue_interest(shard, '2026-01-31') == 1
+    total = 2 * 100000 * DAILY_RATE
+    credit = int(total * 100) / 100
+    [(amount, balance_after, created_at)] = interest_postings(savings, shard)
+    assert amount == pytest.approx(credit) and balance_after == pytest.approx(100000 + credit) == balance(savings)
+    assert created_at[:10] == datetime.now().strftime('%Y-%m-%d')
+    assert accrual(savings, shard) == (pytest.approx(total - credit), '2026-01-31')
+
+    # Rerunning a date is a no-op, and the checking account (no APY) never accrues
+    assert server.accrue_interest(shard, '2026-01-31') == 0
+    assert len(interest_postings(savings, shard)) == 1
+    assert accrual(accounts['checking'], shard)[1] is None
+
+
+def test_days_skipped_between_runs_are_accrued(customer):
+    payer, _, shard, accounts = customer()
+    payer.post('/api/deposit', {'account_id': 'savings', 'amount': 50000})
+    server.accrue_interest(shard, '2026-03-10')
+    server.accrue_interest(shard, '2026-03-14')
+    assert accrual(accounts['savings'], shard)[0] == pytest.approx(50000 * DAILY_RATE * 5)
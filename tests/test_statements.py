@@ -0,0 +1,65 @@
+import os
+from datetime import datetime
+
+import server
+
+
+def statement(payer, account_id, start=None, end=None):
+    query = f"/api/accounts/statement?account_id={account_id}" + (f"&from={start}" if start else '') + (f"&to={end}" if end else '')
+    status, data = payer.get(query)
+    assert status == 200 and data['success']
+    return data['statement']
+
+
+def backdate(shard, account_id, *dates):
+    # Moves the account's oldest postings, in order, to the given timestamps
+    def move(c):
+        ids = [row[0] for row in c.execute('SELECT id FROM transactions WHERE from_account_id = ? ORDER BY rowid', (account_id,))]
+        c.executemany('UPDATE transactions SET created_at = ? WHERE id = ?', zip(dates, ids))
+    server.run_write(shard, move)
+
+
+def test_opening_and_closing_balances(customer):
+    payer, _, _, accounts = customer(deposit=1000)
+    checking = accounts['checking']
+    payer.post('/api/transfer', {'from_account_id': checking, 'amount': 200})
+    payer.post('/api/transfer', {'from_account_id': checking, 'amount': 100})
+
+    full = statement(payer, checking)
+    assert (full['opening_balance'], full['closing_balance']) == (0, 700)
+    assert [line['amount'] for line in full['lines']] == [1000, -200, -100]
+
+    later = statement(payer, checking, '9000-01-01')
+    assert later['lines'] == [] and later['opening_balance'] == later['closing_balance'] == 700
+    assert statement(payer, accounts['savings'])['opening_balance'] is None
+
+
+def test_statements_span_archived_months_and_checkpoints(customer):
+    payer, _, shard, accounts = customer(deposit=1000)
+    checking = accounts['checking']
+    payer.post('/api/transfer', {'from_account_id': checking, 'amount': 200})
+    payer.post('/api/transfer', {'from_account_id': checking, 'amount': 100})
+    backdate(shard, checking, '2025-01-15T10:00:00', '2025-02-10T10:00:00')
+
+    month = datetime.now().strftime('%Y-%m-01')
+    assert server.write_monthly_checkpoints(shard) and not server.write_monthly_checkpoints(shard)
+    server.write_balance_checkpoints(shard, '2025-06-01')
+    conn = server.connect_db(shard)
+    assert conn.execute('SELECT as_of, balance FROM balance_checkpoints WHERE account_id = ? ORDER BY as_of', (checking,)).fetchall() == [
+        ('2025-06-01', 800), (month, 800)]
+    conn.close()
+
+    assert server.archive_transactions(shard, 0) == 2
+    february = statement(payer, checking, '2025-02-01', '2025-03-01')
+    assert [line['amount'] for line in february['lines']] == [-200]
+    assert (february['opening_balance'], february['closing_balance']) == (1000, 800)
+    march = statement(payer, checking, '2025-03-01', '2025-04-01')
+    assert march['lines'] == [] and march['opening_balance'] == march['closing_balance'] == 800
+    current = statement(payer, checking, month)
+    assert (current['opening_balance'], current['closing_balance']) == (800, 700)
+
+    # With the archive files gone, the opening balance falls back to the checkpoints
+    for name in os.listdir(server.ARCHIVE_DIR):
+        os.remove(os.path.join(server.ARCHIVE_DIR, name))
+    june = statement(payer, checking, '2025-06-01', '2025-07-01')
+    assert june['lines'] == [] and june['opening_balance'] == june['closing_balance'] == 800